@@ -2,10 +2,182 @@
 # Author: Dallin Nielson
 # Code for scraping data for tunes on thesession.org
 
+import io
+import os
 import re
-import requests
+import html as html_lib
+import gzip
+import zlib
+import time
+import atexit
+import asyncio
+import httpx
+import orjson
+import aiofiles
 import pandas as pd
-from bs4 import BeautifulSoup
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from pathlib import Path
+from selectolax.lexbor import LexborHTMLParser
+
+try:
+    import hyperscan
+except ImportError:
+    hyperscan = None
+
+
+TUNES_URL = r'https://thesession.org/tunes/'
+HEADERS = {'User-Agent': 'session_tunes (Irish-Tunes scraper)'}
+
+# Files where the library of compiled tunes is saved. The library is stored
+# as Parquet, and a copy is exported to tunes.json for the analysis notebook.
+LIBRARY_PATH = Path('tunes.parquet')
+JSON_LIBRARY_PATH = Path('tunes.json')
+
+# File where main appends each new tune as a line of JSON as soon as it is
+# parsed, so a run that is interrupted can pick up where it left off
+PROGRESS_PATH = Path('tunes.jsonl')
+
+# thesession.org publishes its data as CSV files, which are used to build
+# the library in bulk instead of scraping every tune page
+DUMP_URL = r'https://github.com/adactio/TheSession-data/raw/main/csv/'
+
+# The data dump has no collections or set pairings for a tune. When True,
+# main also scrapes the pages of the tunes that were built from the dump to
+# fill them in; otherwise only the tunes missing from the dump are scraped.
+BACKFILL_DUMP_TUNES = False
+
+# Directory where the HTML of each tune page that has been downloaded is
+# kept, so later runs can read the page from disk instead of the network
+CACHE_DIR = Path('cache')
+
+# Cached pages older than this many seconds (30 days) are downloaded again,
+# so that changes to a tune's page are eventually picked up
+CACHE_MAX_AGE = 30 * 24 * 60 * 60
+
+# The number of tune pages that are requested at the same time
+MAX_CONCURRENT_REQUESTS = 15
+
+# Patterns for finding the counts on a tune's page, compiled once rather
+# than for every tune that is parsed. Each one captures the count.
+_COLLECTION_RE = re.compile(r'(\d[\d,]*) other tune collections',
+                            re.IGNORECASE)
+_TUNESETS_RE = re.compile(r'(\d[\d,]*) tune sets', re.IGNORECASE)
+_TUNEBOOKS_RE = re.compile(r'has been added to (\d[\d,]*) tunebooks',
+                           re.IGNORECASE)
+
+# When True, tune pages fetched by get_tunes_async are parsed by scanning
+# the raw HTML with the regexes below (strain_soup_fast). Set it to False to
+# build a parse tree for each page instead (strain_soup), e.g. to check
+# that the two give the same results.
+USE_FAST_PARSER = True
+
+# Patterns for strain_soup_fast, which reads each field straight from the
+# bytes of a tune's page. Each one starts at the element it reads, and
+# the opening tag patterns are followed by _element_end to find where an
+# element that can contain others of the same tag ends. Tag names in HTML
+# aren't case sensitive, so none of the patterns are.
+_H1_RE = re.compile(rb'<h1\b[^>]*>(.*?)</h1>', re.S | re.I)
+_INFO_RE = re.compile(
+    rb'<p\b[^>]*\bclass="(?:[^"]*\s)?info(?:\s[^"]*)?"[^>]*>(.*?)</p>',
+    re.S | re.I)
+_PARAGRAPH_RE = re.compile(rb'<p\b[^>]*>(.*?)</p>', re.S | re.I)
+_LINK_RE = re.compile(rb'<a\b[^>]*>(.*?)</a>', re.S | re.I)
+_DETAILS_RE = re.compile(rb'<details\b[^>]*>', re.I)
+_SUMMARY_RE = re.compile(rb'<summary\b[^>]*>', re.I)
+_STATS_RE = re.compile(
+    rb'<(\w+)\b[^>]*\bclass="(?:[^"]*\s)?stats(?:\s[^"]*)?"[^>]*>', re.I)
+_SHEETMUSIC_RE = re.compile(
+    rb'<div\b[^>]*\bclass="(?:[^"]*\s)?setting-sheetmusic(?:\s[^"]*)?"',
+    re.I)
+_STATS_ID_RE = re.compile(rb'<a\b[^>]*\bdata-tuneid="(\d+)"', re.I)
+_TAG_RE = re.compile(rb'<[^>]*>')
+_MAIN_RE = re.compile(rb'<main\b', re.I)
+_MAIN_END_RE = re.compile(rb'.*(</main\s*>)', re.S | re.I)
+
+# Comments and scripts on a page aren't part of the document, so they are
+# blanked out before it is scanned, keeping the position of everything
+# else the same
+_HIDDEN_RE = re.compile(rb'<!--.*?-->|<script\b[^>]*>.*?</script\s*>',
+                        re.S | re.I)
+
+# The patterns for the elements that the counts are read from, by tag
+_ELEMENT_RES = {b'a': _LINK_RE, b'p': _PARAGRAPH_RE}
+
+# Where on a page strain_soup_fast should try each of the patterns above:
+# the start of the element for the tags, and the words of the phrase for
+# the counts (the <a> or <p> element around the phrase is then found, and
+# its text is checked with the count pattern, like strain_soup does). If
+# Hyperscan is installed, all of these are found in a single pass over the
+# page. Hyperscan has no capture groups or backreferences, so whether a
+# field really is at a position is decided by the regex itself. Like the
+# patterns above, these aren't case sensitive.
+_ANCHOR_PATTERNS = [
+    # (name, expression)
+    ('h1', rb'<h1\b'),
+    ('info', rb'<p\b[^>]*\bclass="(?:[^"]*\s)?info'),
+    ('collections', rb'other tune collections'),
+    ('sets', rb'tune sets'),
+    ('books', rb'tunebooks'),
+    ('summary', rb'<details\b'),
+    ('stats', rb'<\w+\b[^>]*\bclass="(?:[^"]*\s)?stats'),
+    ('tabs', rb'<div\b[^>]*\bclass="(?:[^"]*\s)?setting-sheetmusic'),
+]
+
+# The _ANCHOR_PATTERNS as regexes, for when Hyperscan isn't installed
+_ANCHOR_RES = {name: re.compile(expression, re.IGNORECASE)
+               for name, expression in _ANCHOR_PATTERNS}
+
+# Patterns for the opening and closing tags of each tag name passed to
+# _element_end, compiled the first time the tag is needed
+_TAG_PATTERNS = {}
+
+# Settings shared by the synchronous and asynchronous clients. Redirects
+# are followed (e.g. for a tune that was merged into another), as
+# raise_for_status treats a redirect response as an error.
+LIMITS = httpx.Limits(max_keepalive_connections=10, max_connections=20)
+TRANSPORT_OPTIONS = {'http2': True, 'retries': 2, 'limits': LIMITS}
+CLIENT_OPTIONS = {'headers': HEADERS, 'timeout': 15.0,
+                  'follow_redirects': True}
+
+# Responses with these statuses are usually temporary (rate limiting or an
+# overloaded server), so the request is sent again up to MAX_RETRIES times,
+# waiting RETRY_BACKOFF seconds and then twice as long after each attempt
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+MAX_RETRIES = 2
+RETRY_BACKOFF = 0.5
+
+# The HTTP/2 session shared by the synchronous requests, created by
+# get_session the first time it is needed
+_session = None
+
+
+def get_session():
+
+    """
+    Returns the HTTP/2 session that is shared by every synchronous request,
+    so that the HTTPS connection to thesession.org is kept alive between
+    tune pages instead of being re-established each time, and requests are
+    multiplexed over it. httpx asks for compressed responses (including
+    Brotli when the brotli package is installed) and decodes them
+    automatically.
+
+    The session is created the first time this is called rather than when
+    the module is imported, so session_tunes can be imported (e.g. by the
+    analysis notebook) without the h2 package installed.
+
+    :return: an httpx.Client
+    """
+
+    global _session
+
+    if _session is None:
+        _session = httpx.Client(
+            transport=httpx.HTTPTransport(**TRANSPORT_OPTIONS),
+            **CLIENT_OPTIONS)
+        atexit.register(_session.close)
+
+    return _session
 
 
 def set_display_options():
@@ -19,36 +191,281 @@ def set_display_options():
     pd.set_option('display.max_columns', None)
 
 
-def get_soup(tune_id):
+def load_library():
 
     """
-    Looks up a tune on thesession.org and returns a BeautifulSoup object
-    from its webpage.
+    Loads the library of previously compiled tunes, reading the Parquet
+    library if there is one and the older tunes.json library otherwise. If
+    neither exists, the library is built from thesession.org data dump.
 
-    :param tune_id: the id of the tune to search for
-    :return: a BeautifulSoup object for the tune on thesession.org
+    :return: a pandas DataFrame of tunes, indexed by tune id
+    """
+
+    if LIBRARY_PATH.exists():
+        return pd.read_parquet(LIBRARY_PATH)
+
+    if JSON_LIBRARY_PATH.exists():
+        return load_json(JSON_LIBRARY_PATH)
+
+    return bootstrap_from_dump()
+
+
+def save_library(library):
+
+    """
+    Saves the library of compiled tunes as a zstd-compressed Parquet file.
+
+    :param library: a pandas DataFrame of tunes, indexed by tune id
+    """
+
+    library.to_parquet(LIBRARY_PATH, compression='zstd')
+
+
+def load_json(path):
+
+    """
+    Reads a library of tunes that was saved in pandas' default JSON layout
+    ({column: {tune id: value}}), decoding it with orjson.
+
+    :param path: the path of the JSON file
+    :return: a pandas DataFrame of tunes, indexed by tune id
+    """
+
+    library = pd.DataFrame(orjson.loads(path.read_bytes()))
+    library.index = library.index.astype(int)
+
+    return library
+
+
+def export_json(library, path=None):
+
+    """
+    Saves the library of compiled tunes as JSON in pandas' default layout
+    ({column: {tune id: value}}), encoding it with orjson.
+
+    :param library: a pandas DataFrame of tunes, indexed by tune id
+    :param path: the path of the JSON file, 'tunes.json' by default
+    """
+
+    if path is None:
+        path = JSON_LIBRARY_PATH
+
+    # Series.tolist converts the values to Python objects in one pass, which
+    # is much quicker than DataFrame.to_dict
+    tune_ids = library.index.tolist()
+    columns = {column: dict(zip(tune_ids, library[column].tolist()))
+               for column in library.columns}
+
+    path.write_bytes(orjson.dumps(
+        columns, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY))
+
+
+def load_progress():
+
+    """
+    Reads the tunes that were saved to 'tunes.jsonl' by an earlier run that
+    didn't finish.
+
+    :return: a list of dictionaries with information about each tune
     """
 
-    tunes_url = r'https://thesession.org/tunes/'
+    if not PROGRESS_PATH.exists():
+        return []
 
-    attempts = 0
-    awaiting_response = True
-    while awaiting_response and attempts < 2:
+    lines = PROGRESS_PATH.read_bytes().splitlines()
+
+    records = []
+    for number, line in enumerate(lines, start=1):
+
+        # Skip the last line if the run stopped while it was being written.
+        # Any other line that can't be read means the file is damaged.
         try:
-            r = requests.get(tunes_url + str(tune_id))
-            awaiting_response = False
-        except:
-            attempts += 1
+            records.append(orjson.loads(line))
+        except orjson.JSONDecodeError:
+            if number == len(lines):
+                break
+            raise
+
+    return records
+
+
+def read_dump_csv(file_name, columns):
+
+    """
+    Downloads one of the CSV files from thesession.org data dump, and checks
+    that it has the columns the library is built from.
+
+    :param file_name: the name of the CSV file, e.g. 'tunes.csv'
+    :param columns: the names of the columns the file must have
+    :return: a pandas DataFrame with the contents of the file
+    """
+
+    r = get_session().get(DUMP_URL + file_name, timeout=60)
+    r.raise_for_status()
+
+    data = pd.read_csv(io.BytesIO(r.content))
+
+    # The layout of the dump isn't guaranteed, so fail clearly if it has
+    # changed rather than building a library from the wrong columns
+    missing = [column for column in columns if column not in data.columns]
+    if missing:
+        raise ValueError(
+            f"{file_name} from the data dump is missing the column(s) "
+            f"{', '.join(missing)}; found {', '.join(data.columns)}.")
+
+    return data
+
+
+def format_aliases(aliases):
+
+    """
+    Joins the alternate names of a tune in the same format as the
+    "Also known as" paragraph on the tune's webpage.
+
+    :param aliases: a pandas Series of alternate names for one tune
+    :return: a string containing the alternate names for the tune
+    """
+
+    return ', '.join(sorted(aliases.dropna().unique())) + '.'
 
-    # If there is an error with the HTTP response, raise an error
+
+def bootstrap_from_dump():
+
+    """
+    Builds the library of tunes from the CSV files in thesession.org data
+    dump, rather than by scraping every tune page, and saves it to
+    'tunes.parquet'.
+
+    The dump has no equivalent of a tune's collections or the tunes it is
+    commonly recorded with, so the 'collections' and 'set_pairings' columns
+    are left empty. Set BACKFILL_DUMP_TUNES to have main fill them in from
+    the tune pages.
+
+    :return: a pandas DataFrame of tunes, indexed by tune id
+    """
+
+    tunes = read_dump_csv('tunes.csv',
+                          ['tune_id', 'setting_id', 'name', 'type'])
+    aliases = read_dump_csv('aliases.csv', ['tune_id', 'alias'])
+    popularity = read_dump_csv('tune_popularity.csv',
+                               ['tune_id', 'tunebooks'])
+    recordings = read_dump_csv('recordings.csv', ['tune_id'])
+    sets = read_dump_csv('sets.csv', ['tuneset', 'tune_id'])
+
+    # tunes.csv has one row per setting (aka. tab) of each tune
+    settings = tunes.groupby('tune_id')
+    tune_ids = settings.size().index
+
+    # Count each set once, even if the tune appears in it more than once
+    tune_sets = sets.drop_duplicates(['tuneset', 'tune_id'])
+
+    library = pd.DataFrame({
+        "name": settings['name'].first(),
+        "aliases": aliases.groupby('tune_id')['alias'].apply(format_aliases),
+        "type": settings['type'].first(),
+        "set_pairings": None,
+        "tabs": settings['setting_id'].nunique(),
+        "recordings": recordings.groupby('tune_id').size(),
+        "collections": None,
+        "sets": tune_sets.groupby('tune_id').size(),
+        "books": popularity.set_index('tune_id')['tunebooks'],
+    }, index=tune_ids)
+
+    # Tunes that don't appear in aliases.csv, recordings.csv, sets.csv or
+    # tune_popularity.csv have no aliases, recordings, sets or tune books,
+    # matching the 0 that strain_soup gives for a missing count
+    library = library.fillna(
+        {"aliases": "", "recordings": 0, "sets": 0, "books": 0})
+    library = library.astype({"recordings": int, "sets": int, "books": int})
+    library.index.name = 'id'
+
+    save_library(library)
+    return library
+
+
+def read_cache(tune_id):
+
+    """
+    Reads the HTML for a tune page from the cache directory, unless it was
+    cached more than CACHE_MAX_AGE seconds ago.
+
+    :param tune_id: the id of the tune to look up
+    :return: the page's HTML bytes, or None if the page has not been cached,
+        its copy has expired or the file can't be read
+    """
+
+    path = CACHE_DIR / f'{tune_id}.html.gz'
+    try:
+        cached_at = path.stat().st_mtime
+    except FileNotFoundError:
+        return None
+
+    if time.time() - cached_at > CACHE_MAX_AGE:
+        return None
+
+    # A damaged file (e.g. an older version of the cache that was cut off)
+    # is treated as a page that hasn't been cached, so it is downloaded and
+    # written again
     try:
+        with gzip.open(path, 'rb') as f:
+            return f.read()
+    except (EOFError, OSError, zlib.error):
+        return None
+
+
+def write_cache(tune_id, html):
+
+    """
+    Saves the HTML for a tune page to the cache directory.
+
+    :param tune_id: the id of the tune that the page belongs to
+    :param html: the page's HTML bytes
+    """
+
+    CACHE_DIR.mkdir(exist_ok=True)
+    path = CACHE_DIR / f'{tune_id}.html.gz'
+
+    # Write to a temporary file and then move it into place, so that a run
+    # that is stopped part way through a write doesn't leave a cut off page
+    # in the cache
+    temp_path = CACHE_DIR / f'{tune_id}.html.gz.tmp'
+    with gzip.open(temp_path, 'wb') as f:
+        f.write(html)
+    os.replace(temp_path, path)
+
+
+def get_soup(tune_id):
+
+    """
+    Looks up a tune on thesession.org and returns a selectolax parse tree
+    of its webpage. Pages that have been downloaded before are read from
+    the cache instead.
+
+    :param tune_id: the id of the tune to search for
+    :return: a LexborHTMLParser for the tune on thesession.org
+    """
+
+    html = read_cache(tune_id)
+
+    if html is None:
+
+        # Connection retries are handled by the session's transport, and
+        # temporary error statuses are retried here. If the request still
+        # fails, or there is an error with the HTTP response, an
+        # httpx.HTTPError is raised
+        for attempt in range(MAX_RETRIES + 1):
+            r = get_session().get(TUNES_URL + str(tune_id))
+            if r.status_code not in RETRY_STATUSES or attempt == MAX_RETRIES:
+                break
+            time.sleep(RETRY_BACKOFF * 2 ** attempt)
         r.raise_for_status()
-    except:
-        raise requests.HTTPError
 
-    soup = BeautifulSoup(r.text, 'html.parser')
+        html = r.content
+        write_cache(tune_id, html)
+
+    tree = LexborHTMLParser(html)
 
-    return soup
+    return tree
 
 
 def get_session_tunes(pages, start=1, library=None):
@@ -77,41 +494,229 @@ def get_session_tunes(pages, start=1, library=None):
     else:
         tune_list = []
 
+    # Make room for a result for every page, so each one is stored at its
+    # own position (num - start) rather than growing the list
+    tunes_found = [None] * pages
+
     # Iterate over each page in the sequence that was specified
     for num in range(start, start + pages):
 
-        # Try to get the response and create the bs4 soup.
+        # Try to get the response and create the parse tree.
         # If there is an error with the HTTP response, skip the iteration
         try:
-            soup = get_soup(num)
-        except requests.HTTPError:
+            tree = get_soup(num)
+        except httpx.HTTPError:
             continue
 
-        # Get the compiled info from the soup and append it to the tune_list
-        strained_soup = strain_soup(soup, num)
-        tune_list.append(strained_soup)
+        # Get the compiled info from the tree and store it for the page
+        tunes_found[num - start] = strain_soup(tree, num)
+
+    # Add the pages that were found to the tune_list
+    tune_list.extend([tune for tune in tunes_found if tune is not None])
 
-    id_range = f'{start}-{start + pages - 1}'
-    print(f'Obtained data for {len(tune_list)} tunes (IDs {id_range}).')
     return tune_list
 
 
-def strain_soup(soup, tune_id):
+async def fetch(client, tune_id, sem):
+
+    """
+    Requests the webpage for a tune on thesession.org, waiting for a free
+    slot in the semaphore so only a limited number of requests are in
+    flight at once. Pages that have been downloaded before are read from
+    the cache instead.
+
+    :param client: an httpx.AsyncClient used to send the request
+    :param tune_id: the id of the tune to request
+    :param sem: an asyncio.Semaphore limiting the concurrent requests
+    :return: a tuple containing 1. the tune id and 2. the page's HTML bytes
+    """
+
+    # Reading and writing the gzipped cache blocks, so it is done in a
+    # thread to keep the event loop free for the other requests
+    html = await asyncio.to_thread(read_cache, tune_id)
+    if html is not None:
+        return tune_id, html
+
+    # Temporary error statuses are retried after a delay. The request keeps
+    # its slot in the semaphore while it waits, so a rate limited server
+    # isn't sent more requests in the meantime.
+    async with sem:
+        for attempt in range(MAX_RETRIES + 1):
+            r = await client.get(f'{TUNES_URL}{tune_id}')
+            if r.status_code not in RETRY_STATUSES or attempt == MAX_RETRIES:
+                break
+            await asyncio.sleep(RETRY_BACKOFF * 2 ** attempt)
+        r.raise_for_status()
+
+    await asyncio.to_thread(write_cache, tune_id, r.content)
+    return tune_id, r.content
+
+
+def _parse_one(page):
+
+    """
+    Parses the HTML of one tune page and returns its information. This runs
+    in a worker process, so it takes a single picklable argument.
+
+    :param page: a tuple containing 1. the tune id and 2. the page's HTML
+    :return: a dictionary with information about the tune
+    """
+
+    tune_id, html = page
+
+    if USE_FAST_PARSER:
+        return strain_soup_fast(html, tune_id)
+
+    tree = LexborHTMLParser(html)
+
+    return strain_soup(tree, tune_id)
+
+
+async def scrape_tune(client, tune_id, sem, pool=None, progress=None):
+
+    """
+    Requests the webpage for one tune, parses it (in the process pool if one
+    is given), and appends the tune's information to the progress file if
+    one is open.
+
+    :param client: an httpx.AsyncClient used to send the request
+    :param tune_id: the id of the tune to request
+    :param sem: an asyncio.Semaphore limiting the concurrent requests
+    :param pool: an optional ProcessPoolExecutor that the page is parsed in
+    :param progress: an optional aiofiles file opened in 'ab' mode
+    :return: a dictionary with information about the tune
+    """
+
+    page = await fetch(client, tune_id, sem)
+
+    # Building a parse tree is CPU bound, so it is done in a separate
+    # process. The fast parser takes less time than sending the page to
+    # another process would, so without a pool the page is parsed here.
+    if pool is None:
+        tune = _parse_one(page)
+    else:
+        loop = asyncio.get_running_loop()
+        tune = await loop.run_in_executor(pool, _parse_one, page)
+
+    # Flush each tune so that it is in the file even if the run is killed
+    # before the file is closed
+    if progress is not None:
+        await progress.write(orjson.dumps(tune) + b'\n')
+        await progress.flush()
+
+    return tune
+
+
+async def get_tunes_async(tune_ids, library=None, progress_path=None,
+                          pool=None):
+
+    """
+    Requests the tune pages for the given tune IDs concurrently, and parses
+    each page that is found into a dictionary of information about the
+    tune. Unless USE_FAST_PARSER is set, the pages are parsed in parallel
+    across the CPU cores.
+
+    :param tune_ids: An iterable of the tune IDs to request
+    :param library: An optional list of previously compiled tunes
+    :param progress_path: An optional path of a file that each tune is
+        appended to as a line of JSON as soon as it has been parsed
+    :param pool: An optional ProcessPoolExecutor to parse the pages in when
+        USE_FAST_PARSER is False, so that one pool can be shared by many
+        calls. If it isn't given, a pool is created for this call.
+    :return: a list of dictionaries with information about each tune that
+        was discovered on thesession.org.
+    """
+
+    if library is not None:
+        try:
+            assert type(library) == list
+            tune_list = library
+        except AssertionError:
+            raise AssertionError("library must be a 1D list.")
+    else:
+        tune_list = []
+
+    # The fast parser runs in this process, so only the parse tree needs a
+    # process pool
+    own_pool = None
+    if USE_FAST_PARSER:
+        pool = None
+    elif pool is None:
+        pool = own_pool = ProcessPoolExecutor()
+
+    progress = None
+    if progress_path is not None:
+        progress = await aiofiles.open(progress_path, 'ab')
+
+    # Request, parse and save every page in tune_ids, with at most
+    # MAX_CONCURRENT_REQUESTS requests in flight at once
+    sem = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+    transport = httpx.AsyncHTTPTransport(**TRANSPORT_OPTIONS)
+    try:
+        async with httpx.AsyncClient(transport=transport,
+                                     **CLIENT_OPTIONS) as client:
+            results = await asyncio.gather(
+                *[scrape_tune(client, num, sem, pool, progress)
+                  for num in tune_ids],
+                return_exceptions=True)
+    finally:
+        if progress is not None:
+            await progress.close()
+        if own_pool is not None:
+            own_pool.shutdown()
+
+    # If there was an error with the HTTP response, skip the page.
+    # Any other exception is a real error, so raise it.
+    for result in results:
+        if isinstance(result, httpx.HTTPError):
+            continue
+        elif isinstance(result, BaseException):
+            raise result
+        tune_list.append(result)
+
+    return tune_list
+
+
+async def get_session_tunes_async(pages, start=1, library=None):
+
+    """
+    Asynchronous version of get_session_tunes: the tune pages are requested
+    concurrently, then the pages that were found are parsed in parallel
+    across the CPU cores into dictionaries of information about each tune.
+
+    :param pages: The number of pages to iterate over on thesession.org
+    :param start: The starting point for the iteration
+    :param library: An optional list of previously compiled tunes
+    :return: a list of dictionaries with information about each tune that
+        was discovered on thesession.org.
+    """
+
+    return await get_tunes_async(range(start, start + pages), library)
+
+
+def strain_soup(tree, tune_id):
     """
     Parses HTML from a tune at thesession.org and returns its information.
 
-    :param soup: A BeautifulSoup object
+    :param tree: a LexborHTMLParser for the tune's webpage
     :param tune_id: integer representing the ID of the tune on the website
     :return: a dictionary with information about the tune
     """
 
-    # Run the functions that parse the soup to retrieve the data from its
+    # All of the tune's information is inside the <main> section, so find it
+    # once and limit the searches to it rather than scanning the whole page
+    # (header, navigation, footer, etc.) for every field
+    main = tree.css_first('main')
+    if main is None:
+        main = tree
+
+    # Run the functions that parse the tree to retrieve the data from its
     # elements
-    tune_type, tune_name = parse_h1(soup)
-    recordings = parse_summary(soup)
-    recorded_with = parse_stats(soup)
-    aliases, collections, tune_sets, tune_books = parse_paragraphs(soup)
-    tabs = parse_tabs(soup)
+    tune_type, tune_name = parse_h1(main)
+    recordings = parse_summary(main)
+    recorded_with = parse_stats(main)
+    aliases, collections, tune_sets, tune_books = parse_paragraphs(main)
+    tabs = parse_tabs(main)
 
     # Create the dictionary with the final output
     strained_soup = {
@@ -130,42 +735,354 @@ def strain_soup(soup, tune_id):
     return strained_soup
 
 
-def parse_h1(soup_obj):
+def compile_hyperscan_database():
+
+    """
+    Compiles the _ANCHOR_PATTERNS into a Hyperscan database, which scans a
+    page for all of the patterns at once.
+
+    :return: a hyperscan.Database, or None if Hyperscan isn't installed
+    """
+
+    if hyperscan is None:
+        return None
+
+    flags = hyperscan.HS_FLAG_SOM_LEFTMOST | hyperscan.HS_FLAG_CASELESS
+
+    database = hyperscan.Database()
+    database.compile(
+        expressions=[expression for _, expression in _ANCHOR_PATTERNS],
+        ids=list(range(len(_ANCHOR_PATTERNS))),
+        elements=len(_ANCHOR_PATTERNS),
+        flags=[flags] * len(_ANCHOR_PATTERNS))
+
+    return database
+
+
+_HYPERSCAN_DATABASE = compile_hyperscan_database()
+
+
+def strain_soup_fast(html, tune_id):
+    """
+    Parses HTML from a tune at thesession.org and returns its information,
+    like strain_soup, but by scanning the page's bytes with precompiled
+    regular expressions (located with Hyperscan when it is installed)
+    instead of building a parse tree.
+
+    :param html: the bytes of the tune's webpage
+    :param tune_id: integer representing the ID of the tune on the website
+    :return: a dictionary with information about the tune
+    """
+
+    html = _HIDDEN_RE.sub(_blank_out, html)
+
+    # Limit the scans to the <main> section, like strain_soup
+    main = _MAIN_RE.search(html)
+    main_end = _MAIN_END_RE.match(html)
+    if main is None or main_end is None or main_end.start(1) <= main.start():
+        start, end = 0, len(html)
+    else:
+        start, end = main.start(), main_end.start(1)
+
+    anchors = _find_anchors(html, start, end)
+
+    # Get the tune type and name from the H1 heading
+    h1 = _first_match(_H1_RE, html, anchors['h1'], end)
+    if h1 is None:
+        tune_type, tune_name = 'H1 Error', 'H1 Error'
+    else:
+        type_link = _LINK_RE.search(h1.group(1))
+        heading = _html_text(h1.group(1))
+        if type_link is not None:
+            tune_type = _html_text(type_link.group(1))
+            tune_name = strip_tune_type(heading, tune_type)
+        else:
+            tune_type, tune_name = 'Error', heading.strip()
+
+    # Get the alternate names (aka aliases) for the tune
+    info = _first_match(_INFO_RE, html, anchors['info'], end)
+    if info is not None:
+        aliases = _html_text(info.group(1)).replace('Also known as\n', '')
+    else:
+        aliases = ""
+
+    # Count the sheet music tabs
+    tabs = sum(1 for pos in anchors['tabs']
+               if _SHEETMUSIC_RE.match(html, pos, end))
+
+    # Create the dictionary with the final output
+    strained_soup = {
+        "id": tune_id,
+        "name": tune_name,
+        "aliases": aliases,
+        "type": tune_type,
+        "set_pairings": _fast_stats(html, anchors['stats'], end),
+        "tabs": tabs,
+        "recordings": _fast_summary(html, anchors['summary'], end),
+        "collections": _fast_count(html, start, end, anchors['collections'],
+                                   b'a', _COLLECTION_RE),
+        "sets": _fast_count(html, start, end, anchors['sets'],
+                            b'a', _TUNESETS_RE),
+        "books": _fast_count(html, start, end, anchors['books'],
+                             b'p', _TUNEBOOKS_RE),
+    }
+
+    return strained_soup
+
+
+def _blank_out(match):
+
     """
-    Takes a bs4.BeautifulSoup object representing a tunes page from
+    Replaces a comment or script with an empty tag of the same length, which
+    none of the patterns match and _html_text removes.
+
+    :param match: an re.Match of _HIDDEN_RE
+    :return: the bytes to replace the match with
+    """
+
+    return b'<' + b' ' * (len(match.group()) - 2) + b'>'
+
+
+def _html_text(fragment):
+
+    """
+    Returns the text in a fragment of HTML, without its tags and with the
+    character references (e.g. &amp;) decoded.
+
+    :param fragment: a bytes string of HTML
+    :return: a string with the text of the fragment
+    """
+
+    text = _TAG_RE.sub(b'', fragment).decode('utf-8', errors='replace')
+
+    return html_lib.unescape(text)
+
+
+def _find_anchors(html, start, end):
+
+    """
+    Finds the positions between the start and end of a page where each of
+    the _ANCHOR_PATTERNS matches. With Hyperscan the page is scanned once
+    for all of the patterns; without it, each pattern's positions are found
+    as they are needed.
+
+    :param html: the bytes of a tune's webpage
+    :param start: the position to start searching from
+    :param end: the position to stop searching at
+    :return: a dictionary with an iterable of positions, in order, for each
+        pattern
+    """
+
+    if _HYPERSCAN_DATABASE is None:
+        return {name: (match.start()
+                       for match in pattern.finditer(html, start, end))
+                for name, pattern in _ANCHOR_RES.items()}
+
+    # Collect the positions where each pattern starts. A set is used
+    # because Hyperscan reports a start again for every end it matches at
+    positions = {name: set() for name, _ in _ANCHOR_PATTERNS}
+
+    def on_match(pattern_id, match_from, match_to, flags, context):
+        if start <= match_from < end:
+            positions[_ANCHOR_PATTERNS[pattern_id][0]].add(match_from)
+
+    _HYPERSCAN_DATABASE.scan(html, match_event_handler=on_match)
+
+    return {name: sorted(found) for name, found in positions.items()}
+
+
+def _first_match(pattern, html, positions, end):
+
+    """
+    Returns the first match of a pattern at any of the given positions.
+
+    :param pattern: a compiled bytes regular expression
+    :param html: the bytes of a tune's webpage
+    :param positions: an iterable of positions, in order
+    :param end: the position that the match must end before
+    :return: an re.Match, or None if the pattern doesn't match anywhere
+    """
+
+    found = (pattern.match(html, pos, end) for pos in positions)
+
+    return next((match for match in found if match), None)
+
+
+def _element_end(html, pos, end, tag):
+
+    """
+    Finds where an element ends, skipping over any elements with the same
+    tag that are nested inside it.
+
+    :param html: the bytes of a tune's webpage
+    :param pos: the position just after the element's opening tag
+    :param end: the position to stop searching at
+    :param tag: the element's tag, e.g. b'div'
+    :return: the position of the element's closing tag, or end if it isn't
+        closed
+    """
+
+    tag = tag.lower()
+    pattern = _TAG_PATTERNS.get(tag)
+    if pattern is None:
+        pattern = re.compile(rb'<(/?)' + re.escape(tag) + rb'\b[^>]*>',
+                             re.IGNORECASE)
+        _TAG_PATTERNS[tag] = pattern
+
+    depth = 1
+    for match in pattern.finditer(html, pos, end):
+        depth += -1 if match.group(1) else 1
+        if depth == 0:
+            return match.start()
+
+    return end
+
+
+def _fast_summary(html, positions, end):
+
+    """
+    Reads the number of recordings from the link in the <summary> of the
+    first <details> element, like parse_summary.
+
+    :param html: the bytes of a tune's webpage
+    :param positions: the positions of the <details> elements, in order
+    :param end: the position to stop searching at
+    :return: an integer for the number of times the tune has been recorded
+    """
+
+    details = _first_match(_DETAILS_RE, html, positions, end)
+    if details is None:
+        return 0
+    details_end = _element_end(html, details.end(), end, b'details')
+
+    summary = _SUMMARY_RE.search(html, details.end(), details_end)
+    if summary is None:
+        return 0
+    summary_end = _element_end(html, summary.end(), details_end, b'summary')
+
+    link = _LINK_RE.search(html, summary.end(), summary_end)
+
+    return parse_count(_html_text(link.group(1))) if link else 0
+
+
+def _fast_stats(html, positions, end):
+
+    """
+    Reads the ids of the tunes listed in the first element with the class
+    'stats', like parse_stats.
+
+    :param html: the bytes of a tune's webpage
+    :param positions: the positions where a 'stats' element may start
+    :param end: the position to stop searching at
+    :return: a list of tune ids, or None if there is no 'stats' element
+    """
+
+    stats = _first_match(_STATS_RE, html, positions, end)
+    if stats is None:
+        return None
+
+    stats_end = _element_end(html, stats.end(), end, stats.group(1))
+
+    return [int(tune) for tune in
+            _STATS_ID_RE.findall(html, stats.end(), stats_end)]
+
+
+def _fast_count(html, start, end, positions, tag, pattern):
+
+    """
+    Reads a count from the text of the first element around one of the
+    given positions whose text matches the count pattern, like the counts
+    in parse_paragraphs.
+
+    :param html: the bytes of a tune's webpage
+    :param start: the position that the element must start at or after
+    :param end: the position that the element must end before
+    :param positions: the positions of the count's phrase, in order
+    :param tag: the tag of the element, b'a' or b'p'
+    :param pattern: the count pattern, e.g. _COLLECTION_RE
+    :return: an integer, or 0 if no element has the count
+    """
+
+    openings = (b'<' + tag, b'<' + tag.upper())
+    element = _ELEMENT_RES[tag]
+
+    def find_opening(before):
+        return max(html.rfind(opening, start, before) for opening in openings)
+
+    for pos in positions:
+
+        # Find the nearest opening tag before the phrase that really is
+        # an element of this tag (e.g. <a but not <abbr). The phrase is
+        # only inside it if the element ends after the phrase.
+        elem = None
+        tag_start = find_opening(pos)
+        while tag_start >= 0 and elem is None:
+            elem = element.match(html, tag_start, end)
+            tag_start = find_opening(tag_start)
+        if elem is None or not elem.start(1) <= pos < elem.end(1):
+            continue
+
+        match = pattern.search(_html_text(elem.group(1)))
+        if match:
+            return parse_count(match.group(1))
+
+    return 0
+
+
+def parse_h1(tree):
+    """
+    Takes a selectolax node representing a tunes page from
     thesession.org and returns the tune type and name from the H1 heading
 
-    :param soup_obj: a BeautifulSoup object
+    :param tree: a selectolax node
     :return: a tuple containing 1. the tune type and 2. the tune name
     """
 
     # Find the H1 heading, or return empty content if it isn't found
-    try:
-        h1 = soup_obj.find('h1')
-    except:
+    h1 = tree.css_first('h1')
+    if h1 is None:
         return 'H1 Error', 'H1 Error'
 
-    # Get the Tune Type
-    try:
-        tune_type = h1.find('a').text
-    except:
-        tune_type = 'Error'
-
-    # Get the name of the tune
-    try:
-        tune_name = h1.text.rstrip(tune_type).rstrip(' ')
-    except:
-        tune_name = 'Error'
+    # Get the Tune Type and the name of the tune. Without a type link there
+    # is no tune type to remove, so the whole heading is the name.
+    type_link = h1.css_first('a')
+    if type_link is not None:
+        tune_type = type_link.text()
+        tune_name = strip_tune_type(h1.text(), tune_type)
+    else:
+        tune_type, tune_name = 'Error', h1.text().strip()
 
     return tune_type, tune_name
 
 
-def parse_paragraphs(soup_obj):
+def strip_tune_type(heading, tune_type):
+
+    """
+    Removes the tune type from the end of the text of a tune's H1 heading,
+    leaving the name of the tune. The tune type is only removed when it is
+    a separate word (after a space), so a name that ends in letters of the
+    tune type keeps them (e.g. 'Tom's' in 'Tom's slip jig').
+
+    :param heading: the text of the H1 heading
+    :param tune_type: the tune type, from the link at the end of the heading
+    :return: a string with the name of the tune
+    """
+
+    heading = heading.strip()
+    name = heading[:-len(tune_type)]
+
+    if tune_type and heading.endswith(tune_type) and name[-1:].isspace():
+        return name.rstrip()
+
+    return heading
+
+
+def parse_paragraphs(tree):
 
     """
     Parses the first <p> elements from the <main> section
 
-    :param soup_obj: a bs4 BeautifulSoup object for a thesession.org tune
+    :param tree: a selectolax node for a thesession.org tune
     :return: a tuple with 4 values, containing the following values:
         aliases: a string containing alternate names for the tune
         collections: an integer with the count of collections the tune
@@ -174,105 +1091,103 @@ def parse_paragraphs(soup_obj):
         tune_books: the number of books that the tune belongs to
     """
 
-    # Attempt to extract alternate names (aka aliases) for the tune
-    try:
-        aliases_elem = soup_obj.find('p', attrs={'class': 'info'})
-        aliases = aliases_elem.text.replace('Also known as\n', '')
-    except:
+    # Extract alternate names (aka aliases) for the tune
+    aliases_elem = tree.css_first('p.info')
+    if aliases_elem is not None:
+        aliases = aliases_elem.text().replace('Also known as\n', '')
+    else:
         aliases = ""
 
-    # Attempt to extract the number of collections the tune is a part of
-    try:
-        collection_regex = re.compile(
-            '[\d,]+ other tune collections', re.IGNORECASE)
-
-        collections_text = soup_obj.find('a', string=collection_regex).text
-        collections = parse_count(collections_text)
-    except:
-        collections = 0
-
-    # Attempt to extract the number of tune sets the tune has been added to
-    try:
-        # tune_sets = parse_count(paragraphs[2].text)
-
-        tune_sets_regex = re.compile('[\d,] tune sets', re.IGNORECASE)
-
-        tune_sets_text = soup_obj.find('a', string=tune_sets_regex).text
-        tune_sets = parse_count(tune_sets_text)
-    except:
-        tune_sets = 0
+    # Extract the number of collections the tune is a part of
+    collections_match = _find_match(tree, 'a', _COLLECTION_RE)
+    collections = (parse_count(collections_match.group(1))
+                   if collections_match else 0)
 
-    # Attempt to extract the number of tune books the tune has been added to
-    try:
-        tune_book_regex = re.compile(
-            'has been added to [\d,]+ tunebooks', re.IGNORECASE)
+    # Extract the number of tune sets the tune has been added to
+    # tune_sets = parse_count(paragraphs[2].text)
+    tune_sets_match = _find_match(tree, 'a', _TUNESETS_RE)
+    tune_sets = parse_count(tune_sets_match.group(1)) if tune_sets_match else 0
 
-        tune_book_text = soup_obj.find('p', string=tune_book_regex).text
-        tune_books = parse_count(tune_book_text)
-    except:
-        tune_books = 0
+    # Extract the number of tune books the tune has been added to. The
+    # count is read from the match, as the paragraph may have other numbers
+    # before it (e.g. in the name of the tune)
+    tune_book_match = _find_match(tree, 'p', _TUNEBOOKS_RE)
+    tune_books = (parse_count(tune_book_match.group(1))
+                  if tune_book_match else 0)
 
     return aliases, collections, tune_sets, tune_books
 
 
-def parse_summary(soup_obj):
+def parse_summary(tree):
     """
     Extracts the number of times the tune has been recorded
 
-    :param soup_obj: a bs4 BeautifulSoup object for a thesession.org tune
+    :param tree: a selectolax node for a thesession.org tune
     :return: An integer for the number of times the tune has been recorded
     """
 
-    # Attempt to extract the <summary> elem from the soup object
-    try:
-        summary = soup_obj.find('details').find('summary')
-    except:
-        return 0
+    # Find the Recordings link in the <summary> elem of the tree
+    details = tree.css_first('details')
+    summary = details.css_first('summary') if details is not None else None
+    link = summary.css_first('a') if summary is not None else None
 
-    # Attempt to extract the Recordings list from the summary
-    try:
-        recordings = parse_count(summary.find('a').text)
-        return recordings
-    except:
-        return 0
+    return parse_count(link.text()) if link is not None else 0
 
 
-def parse_stats(soup_obj):
+def parse_stats(tree):
     """
     Extracts the 'data-tuneid' from the <a> element for each tune that
-    is listed under the class='stats' section of the soup_obj
+    is listed under the class='stats' section of the tree
 
-    :param soup_obj: a bs4 Beautiful Soup object for a thesession.org tune
+    :param tree: a selectolax node for a thesession.org tune
     :return: a 1D array of integers for the IDs of tunes that are commonly
-        recording along with the tune in the soup_obj
+        recording along with the tune in the tree
     """
 
-    # Attempt to extract the tunes that are commonly recorded with the
-    # tune in the soup_obj
-    try:
-        return [int(tune['data-tuneid']) for tune in
-                     soup_obj.find(class_='stats').findAll('a')]
-    except (TypeError, AttributeError):
+    # Extract the tunes that are commonly recorded with the tune in the tree
+    stats = tree.css_first('.stats')
+    if stats is None:
         return None
 
+    return [int(tune.attributes['data-tuneid'])
+            for tune in stats.css('a[data-tuneid]')]
+
 
-def parse_tabs(soup_obj):
+def parse_tabs(tree):
 
     """
     Counts the number of tabs (aka. sheet music tabs) on the page
 
-    :param soup_obj: a BeautifulSoup object for a thesession.org tune
+    :param tree: a selectolax node for a thesession.org tune
     :return: and integer for the number of tabs on the page
     """
 
-    try:
-        tabs = soup_obj.findAll('div', attrs={'class': 'setting-sheetmusic'})
-    except:
-        tabs = []
+    tabs = tree.css('div.setting-sheetmusic')
 
     return len(tabs)
 
 
+def _find_match(tree, tag, pattern):
+
+    """
+    Searches the text of each element with the given tag, and returns the
+    match for the first one whose text matches the regular expression
+    pattern.
+
+    :param tree: a selectolax node to search
+    :param tag: the tag of the elements to check
+    :param pattern: a compiled regular expression
+    :return: an re.Match, or None if no element matches
+    """
+
+    for elem in tree.css(tag):
+        match = pattern.search(elem.text())
+        if match:
+            return match
+
+    return None
+
+
 def parse_count(text):
 
     """
@@ -283,42 +1198,96 @@ def parse_count(text):
     :return: an integer, or None if no number was found in the text
     """
 
+    if not text:
+        return None
+
+    # Find the first digit in the text
+    start = next((i for i, char in enumerate(text) if char.isdigit()), -1)
+    if start < 0:
+        return None
+
+    # The number continues for as long as there are digits or commas
+    end = start
+    while end < len(text) and (text[end].isdigit() or text[end] == ','):
+        end += 1
+
     try:
-        num_string = re.search('[\d,]+', text).group()
-        num = int(num_string.replace(',', ''))
+        num = int(text[start:end].replace(',', ''))
         return num
 
-    except (ValueError, AttributeError):
+    except ValueError:
         return None
 
 
 def main():
 
     """
-    Creates equal sized batches, then runs get_session_tunes for each batch
-    and combines the new tunes with the existing tunes in 'tunes.json', then
-    saves the combined data to 'tunes.json'
+    Creates equal sized batches of the tune IDs that are missing from the
+    library, then runs get_tunes_async for each batch and combines the new
+    tunes with the existing tunes in the library, then saves the combined
+    data to 'tunes.parquet' and 'tunes.json' once every batch is done. New
+    tunes are also appended to 'tunes.jsonl' as they are found, so an
+    interrupted run can be resumed.
     """
 
     number_tunes = 24000
     batch_size = 250
     starting_point = 1
 
-    batches = list(range(starting_point, number_tunes, batch_size))
-
-    for batch in batches:
-
-        # run get_session_tunes on the tune id's in the batch
-        new_df = pd.DataFrame(get_session_tunes(batch_size, start=batch))
-        indexed_df = new_df.set_index('id')
-
-        # Import existing tunes from the tunes.json library and combine the
-        # new tunes with the existing library
-        library = pd.read_json('tunes.json')
-        combined_data = pd.concat([library, indexed_df])
-
-        # Save the combined data to tunes.json
-        combined_data.to_json('tunes.json')
+    # Import existing tunes from the library once, and collect the new
+    # tunes in memory instead of rewriting the file for every batch. Any
+    # tunes saved to tunes.jsonl by a run that didn't finish are included.
+    library = load_library()
+    all_records = load_progress()
+
+    # Only scrape the tune pages that aren't in the library already. Tunes
+    # built from the data dump count as found, unless BACKFILL_DUMP_TUNES
+    # is set to scrape them for their collections and set pairings.
+    saved_ids = {record['id'] for record in all_records}
+    if BACKFILL_DUMP_TUNES:
+        found_ids = set(library.index[library['collections'].notna()])
+    else:
+        found_ids = set(library.index)
+    missing = sorted(set(range(starting_point, number_tunes + 1))
+                     - found_ids - saved_ids)
+    batches = [missing[i:i + batch_size]
+               for i in range(0, len(missing), batch_size)]
+
+    # Start the worker processes for the parse tree once and share them
+    # between the batches. The fast parser doesn't need them, so pool is
+    # None when it is used.
+    workers = nullcontext() if USE_FAST_PARSER else ProcessPoolExecutor()
+
+    with workers as pool:
+        for batch in batches:
+
+            # run get_tunes_async on the tune id's in the batch, saving each
+            # new tune to tunes.jsonl as it is parsed
+            new_tunes = asyncio.run(get_tunes_async(
+                batch, progress_path=PROGRESS_PATH, pool=pool))
+            print(f'Obtained data for {len(new_tunes)} tunes '
+                  f'(IDs {batch[0]}-{batch[-1]}).')
+            all_records.extend(new_tunes)
+
+    # Build a single DataFrame from all the new tunes, then combine it with
+    # the existing library and save the combined data to tunes.parquet and
+    # tunes.json
+    if all_records:
+        new_df = pd.DataFrame.from_records(all_records, index='id')
+        new_df = new_df[~new_df.index.duplicated(keep='last')]
+
+        # A scraped tune replaces the row built for it from the data dump.
+        # This also stops a tune being added twice if an earlier run saved
+        # the library but stopped before it could delete tunes.jsonl.
+        library = pd.concat(
+            [library.drop(new_df.index, errors='ignore'), new_df])
+
+    save_library(library)
+    export_json(library)
+
+    # The new tunes are in the library now, so the progress file is no
+    # longer needed
+    PROGRESS_PATH.unlink(missing_ok=True)
 
 
 # Press the green button in the gutter to run the script.
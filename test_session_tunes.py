@@ -0,0 +1,233 @@
+# test_session_tunes.py
+# Checks that strain_soup_fast reads the same information from a tune page
+# as strain_soup, on hand-built pages shaped like thesession.org's, and that
+# the page cache and tunes.jsonl survive an interrupted run
+
+import gzip
+
+import orjson
+import pandas as pd
+import pytest
+from selectolax.lexbor import LexborHTMLParser
+
+import session_tunes
+
+
+# A tune page with every field that strain_soup reads, and a footer outside
+# of <main> whose link must be ignored
+PAGE = '''<!DOCTYPE html>
+<html><head><title>Cooley’s</title></head>
+<body>
+<header><a href="/">thesession.org</a></header>
+<main>
+<h1>Cooley’s <a href="/tunes/search?type=reel">reel</a></h1>
+<p class="info">Also known as
+Cooley’s Reel, Luttrell’s Pass, The Jolly Tinker.</p>
+<p>Also in <a href="/tunes/1/collections">1,234 other tune collections</a></p>
+<p>Added to <a href="/tunes/1/sets">2,345 tune sets</a></p>
+<p>Cooley’s has been added to 10,610 tunebooks.</p>
+<details>
+<summary><a href="/tunes/1/recordings">123 recordings</a></summary>
+<p>Recorded by many.</p>
+</details>
+<div class="stats">
+<a href="/tunes/27" data-tuneid="27">The Silver Spear</a>
+<a href="/tunes/2" data-tuneid="2">The Maid Behind the Bar</a>
+</div>
+<div class="setting-sheetmusic">1</div>
+<div class="setting-sheetmusic">2</div>
+<div class="setting-sheetmusic notes">3</div>
+</main>
+<footer><a href="/tunes/99" data-tuneid="99">Footer tune</a></footer>
+</body></html>'''
+
+COOLEYS = {
+    'id': 1,
+    'name': 'Cooley’s',
+    'aliases': 'Cooley’s Reel, Luttrell’s Pass, The Jolly Tinker.',
+    'type': 'reel',
+    'set_pairings': [27, 2],
+    'tabs': 3,
+    'recordings': 123,
+    'collections': 1234,
+    'sets': 2345,
+    'books': 10610,
+}
+
+
+def page(body):
+    return f'<html><body><main>{body}</main></body></html>'
+
+
+# (page, the fields that both parsers should read from it)
+CASES = {
+    'full page': (PAGE, COOLEYS),
+    'empty page': (page(''), {
+        'name': 'H1 Error', 'type': 'H1 Error', 'aliases': '',
+        'set_pairings': None, 'tabs': 0, 'recordings': 0,
+        'collections': 0, 'sets': 0, 'books': 0}),
+    'no main': ('<h1>Solo <a>jig</a></h1>', {'name': 'Solo', 'type': 'jig'}),
+    'entities': (page('<h1>Tom &amp; Jerry&#8217;s <a>slip jig</a></h1>'
+                      '<p class="lead info">Also known as\nA &lt;B&gt;.</p>'),
+                 {'name': 'Tom & Jerry’s', 'type': 'slip jig',
+                  'aliases': 'A <B>.'}),
+    'nested stats': (page(
+        '<div class="stats"><div><a data-tuneid="27">A</a></div>'
+        '<a data-tuneid="118">B</a></div>'
+        '<a data-tuneid="5">Outside</a>'), {'set_pairings': [27, 118]}),
+    'no stats': (page('<div class="statsbar"><a data-tuneid="3">A</a></div>'),
+                 {'set_pairings': None}),
+    'summary not first': (page(
+        '<details><p>x</p><summary><a>5 recordings</a></summary></details>'),
+        {'recordings': 5}),
+    'markup in links': (page(
+        '<p><a>Also in <b>12</b> other tune collections</a></p>'
+        '<p><a>Added to <span>3</span> tune sets</a></p>'),
+        {'collections': 12, 'sets': 3}),
+    'later link': (page(
+        '<a>Other tune collections</a><a>7 other tune collections</a>'),
+        {'collections': 7}),
+    'number in name': (page(
+        '<h1>20,000 League <a>reel</a></h1>'
+        '<p>20,000 League has been added to 5 tunebooks.</p>'),
+        {'name': '20,000 League', 'books': 5}),
+    'no type link': (page('<h1>Trial Error</h1>'),
+                     {'name': 'Trial Error', 'type': 'Error'}),
+    'type not a word': (page('<h1>Trial<a>reel</a></h1>'),
+                        {'name': 'Trialreel', 'type': 'reel'}),
+    'upper case tags': (page(
+        '<H1>Cooley’s <A HREF="/tunes">reel</A></H1>'
+        '<P CLASS="info">Also known as\nThe Tinker.</P>'
+        '<P><A>4 other tune collections</A></P>'
+        '<P>Has been added to 6 tunebooks.</P>'
+        '<DETAILS><SUMMARY><A>8 recordings</A></SUMMARY></DETAILS>'
+        '<DIV CLASS="stats"><DIV><A DATA-TUNEID="27">A</A></DIV>'
+        '<A DATA-TUNEID="118">B</A></DIV>'
+        '<DIV CLASS="setting-sheetmusic">1</DIV>'), {
+            'name': 'Cooley’s', 'type': 'reel', 'aliases': 'The Tinker.',
+            'collections': 4, 'books': 6, 'recordings': 8,
+            'set_pairings': [27, 118], 'tabs': 1}),
+    'comments': (page(
+        '<!-- <h1>Old <a>jig</a></h1> <p><a>9 tune sets</a></p> -->'
+        '<h1>New <!-- not the type --><a>reel</a></h1>'
+        '<p><a>2 tune sets</a></p>'),
+        {'name': 'New', 'type': 'reel', 'sets': 2}),
+    'scripts': (page(
+        '<script>var s = "<a>9 tune sets</a>";</script>'
+        '<SCRIPT type="text/javascript">"<h1>Old <a>jig</a></h1>"</SCRIPT>'
+        '<h1>New <a>reel</a></h1>'
+        '<p><a>2 tune sets</a></p>'),
+        {'name': 'New', 'type': 'reel', 'sets': 2}),
+    'phrase outside element': (page(
+        '<p><a>a link</a> 4 other tune collections</p>'),
+        {'collections': 0}),
+}
+
+
+@pytest.fixture(params=['regex', 'hyperscan'])
+def scanner(request, monkeypatch):
+    if request.param == 'hyperscan':
+        if session_tunes._HYPERSCAN_DATABASE is None:
+            pytest.skip('hyperscan is not installed')
+    else:
+        monkeypatch.setattr(session_tunes, '_HYPERSCAN_DATABASE', None)
+    return request.param
+
+
+@pytest.mark.parametrize('case', CASES)
+def test_fast_parser_matches_tree(case, scanner):
+    html, expected = CASES[case]
+    tree = session_tunes.strain_soup(LexborHTMLParser(html), 1)
+    fast = session_tunes.strain_soup_fast(html.encode(), 1)
+
+    assert fast == tree
+    assert {field: fast[field] for field in expected} == expected
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(session_tunes, 'CACHE_DIR', tmp_path)
+    return tmp_path
+
+
+def test_cache_round_trip(cache_dir):
+    session_tunes.write_cache(1, PAGE.encode())
+
+    assert session_tunes.read_cache(1) == PAGE.encode()
+    assert [path.name for path in cache_dir.iterdir()] == ['1.html.gz']
+
+
+def test_cut_off_cache_file_is_a_miss(cache_dir):
+    data = gzip.compress(PAGE.encode())
+    (cache_dir / '1.html.gz').write_bytes(data[:len(data) // 2])
+    (cache_dir / '2.html.gz').write_bytes(b'not gzip')
+
+    assert session_tunes.read_cache(1) is None
+    assert session_tunes.read_cache(2) is None
+
+
+def record(tune_id):
+    return dict(COOLEYS, id=tune_id)
+
+
+@pytest.fixture
+def run_dir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+@pytest.fixture
+def scraped(monkeypatch):
+    ids = []
+
+    async def get_tunes_async(tune_ids, library=None, progress_path=None,
+                              pool=None):
+        ids.extend(tune_ids)
+        return []
+
+    monkeypatch.setattr(session_tunes, 'get_tunes_async', get_tunes_async)
+    return ids
+
+
+def write_progress(*lines):
+    session_tunes.PROGRESS_PATH.write_bytes(b'\n'.join(lines))
+
+
+def test_cut_off_last_line_is_skipped(run_dir):
+    write_progress(orjson.dumps(record(1)), orjson.dumps(record(2)),
+                   b'{"id": 3, "na')
+
+    assert [tune['id'] for tune in session_tunes.load_progress()] == [1, 2]
+
+
+def test_damaged_line_raises(run_dir):
+    write_progress(orjson.dumps(record(1)), b'{"id": 2, "na',
+                   orjson.dumps(record(3)))
+
+    with pytest.raises(orjson.JSONDecodeError):
+        session_tunes.load_progress()
+
+
+def test_saved_tunes_are_not_scraped_again(run_dir, scraped):
+    session_tunes.save_library(
+        pd.DataFrame.from_records([record(1), record(2)], index='id'))
+    write_progress(orjson.dumps(record(3)))
+
+    session_tunes.main()
+
+    assert scraped[:2] == [4, 5]
+    assert scraped[-1] == 24000
+    library = pd.read_parquet(session_tunes.LIBRARY_PATH)
+    assert library.index.tolist() == [1, 2, 3]
+    assert not session_tunes.PROGRESS_PATH.exists()
+
+
+def test_leftover_progress_does_not_duplicate_tunes(run_dir, scraped):
+    session_tunes.save_library(
+        pd.DataFrame.from_records([record(1), record(2)], index='id'))
+    write_progress(orjson.dumps(record(2)))
+
+    session_tunes.main()
+
+    library = pd.read_parquet(session_tunes.LIBRARY_PATH)
+    assert library.index.tolist() == [1, 2]